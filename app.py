@@ -1,21 +1,24 @@
+from utils import startup  # first: records process start for the start-up report
 import os
 import json,re
 import datetime as dt
 from pathlib import Path
 import string
-import httpx
-from flask import Flask, request, jsonify, render_template
-from openai import AzureOpenAI
-from utils.auth import functions_auth_headers
-from utils.storage import save_message, save_decision
-from utils.functions_client import start_sre_triage, agent_info_request
-from utils.storage import list_decisions,list_api_logs,save_api_log  # snippet below
-from azure.identity import DefaultAzureCredential
-from azure.core.exceptions import AzureError
-from azure.mgmt.resourcegraph import ResourceGraphClient
-from azure.mgmt.resourcegraph.models import QueryRequest
-from azure.storage.blob import BlobClient
-from azure.data.tables import TableServiceClient
+with startup.timed("import:httpx+flask"):
+    import httpx
+    from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+# Azure SDKs / openai are imported inside the functions that need them (or by the warm-up)
+with startup.timed("import:utils"):
+    from utils.auth import functions_auth_headers, credential
+    from utils.storage import save_decision
+    from utils.functions_client import start_sre_triage, agent_info_request
+    from utils.storage import list_decisions,list_api_logs,save_api_log,get_decision,DECISION_LIST_SELECT  # snippet below
+    from utils.storage import get_table, TABLE_DECISIONS
+    from utils import chat
+    from utils import admission
+    from utils.cache import cache, cached, make_key, get_token
+    from utils import tracing
+    from utils.tracing import span
 from collections import defaultdict
 
 # ----- env / config ----------------------------------------------------------
@@ -31,6 +34,11 @@ AOAI_DEPLOYMENT  = os.getenv("AOAI_DEPLOYMENT", "gpt-4o-mini")
 AOAI_API_VERSION = os.getenv("AOAI_API_VERSION", "2024-02-15-preview")
 AOAI_API_KEY     = os.getenv("AOAI_API_KEY")  # optional; if absent, code uses MSI/AAD
 
+# Cache TTLs (seconds) for memoized lookups, see utils/cache.py
+RESOURCES_CACHE_TTL      = int(os.getenv("RESOURCES_CACHE_TTL", "300"))
+CLASSIFICATION_CACHE_TTL = int(os.getenv("CLASSIFICATION_CACHE_TTL", "900"))
+STATUS_CACHE_TTL         = int(os.getenv("STATUS_CACHE_TTL", "5"))
+
 # Optional: secure webhook signature (Action Group "Enable secure webhook")
 #ALERTS_HMAC_SECRET = os.getenv("ALERTS_HMAC_SECRET")  # if set, verify x-ms-signature (not implemented here by default)
 
@@ -43,6 +51,10 @@ app = Flask(__name__)
 # app.config["TEMPLATES_AUTO_RELOAD"] = True
 # app.jinja_env.auto_reload = True
 
+@app.before_request
+def _first_request():
+    startup.mark_first_request()
+
 # ----- small asserts to catch misconfig at startup ---------------------------
 if not (AGENT_SRE_FUNC_URL and AGENT_SRE_FUNC_URL.startswith("http")):
     print("[WARN] AGENT_SRE_FUNC_URL not set or invalid; /agent-sre proxies will fail.")
@@ -187,16 +199,39 @@ def _aoai_headers() -> dict:
         return {"api-key": AOAI_API_KEY, "Content-Type": "application/json"}
     # Managed Identity / AAD
     try:
-        from azure.identity import DefaultAzureCredential
-        token = DefaultAzureCredential().get_token("https://cognitiveservices.azure.com/.default").token
+        token = get_token(credential(), "https://cognitiveservices.azure.com/.default")
         return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     except Exception:
         return {"Content-Type": "application/json"}  # will 401; caller falls back to heuristic
 
+# Per-firing fields that differ between otherwise identical alerts
+_VOLATILE_ESSENTIALS = ("alertId", "originAlertId", "firedDateTime", "resolvedDateTime", "monitorCondition")
+
+def _classification_key(alert: dict, triage_ctx: dict) -> str:
+    data = dict(alert.get("data") or {})
+    data["essentials"] = {k: v for k, v in (data.get("essentials") or {}).items() if k not in _VOLATILE_ESSENTIALS}
+    ctx = {k: v for k, v in (triage_ctx or {}).items() if k != "run_id"}
+    return make_key("classify", {**alert, "data": data}, ctx)
+
 def _classify_with_aoai(alert: dict, triage_ctx: dict) -> dict:
     """Call Azure OpenAI to classify failure intent. Returns {category, retryable, expected_path, why}."""
+    with span("alert.classify") as sp:
+        result = _classify(alert, triage_ctx)
+        if sp:
+            sp.set("classify.category", result.get("category"))
+        return result
+
+def _classify(alert: dict, triage_ctx: dict) -> dict:
     if not AOAI_ENDPOINT or not AOAI_DEPLOYMENT:
+        tracing.set_attribute("classify.source", "heuristic")
         return _heuristic(triage_ctx, alert)
+    # a flapping pipeline repeats the same failure; only AOAI answers are cached, never the fallback
+    cache_key = _classification_key(alert, triage_ctx)
+    hit, classification = cache.get(cache_key)
+    if hit:
+        tracing.set_attribute("classify.source", "cache")
+        return classification
+    tracing.set_attribute("classify.source", "aoai")
     print("context is {} and  alert is {} ".format(triage_ctx, alert))
 
     url = f"{AOAI_ENDPOINT}/openai/deployments/{AOAI_DEPLOYMENT}/chat/completions?api-version={AOAI_API_VERSION}"
@@ -233,47 +268,64 @@ def _classify_with_aoai(alert: dict, triage_ctx: dict) -> dict:
         "response_format": {"type": "json_object"}
     }
     try:
-        with httpx.Client(timeout=20) as c:
+        with admission.upstream_slot("aoai"), httpx.Client(timeout=20) as c, \
+                span("aoai.chat.completions", kind=tracing.KIND_CLIENT, **{"aoai.deployment": AOAI_DEPLOYMENT}) as up:
             r = c.post(url, headers=_aoai_headers(), json=payload)
+            if up:
+                up.set("http.status_code", r.status_code)
             r.raise_for_status()
             data = r.json()
             content = data["choices"][0]["message"]["content"]
-            return json.loads(content)
+            classification = json.loads(content)
+            cache.set(cache_key, classification, CLASSIFICATION_CACHE_TTL)
+            return classification
+    except admission.Overloaded:
+        print("[AOAI] upstream cap reached; heuristic classification")
+        tracing.set_attribute("classify.source", "heuristic")
+        return _heuristic(triage_ctx, alert)
     except Exception as ex:
         print(f"[AOAI] classify error: {ex}")
+        tracing.set_attribute("classify.source", "heuristic")
+        tracing.set_attribute("classify.error", str(ex)[:300])
         return _heuristic(triage_ctx, alert)
 
 
 # ---------- FIXED HANDLER ----------
 @app.post("/alerts/adf")
+@tracing.traced("POST /alerts/adf")
 def handle_adf_alert():
     """Action Group webhook target. Parses Common Alert Schema, classifies with AOAI, then
        either calls Agent-SRE (retryable/FileNotFound) or accepts for notification."""
     print("Starting to handle alert")
     alert = request.get_json(force=True, silent=True) or {}
     print("[/alerts/adf] schemaId:", alert.get("schemaId"))
-    # Determine alert flavor robustly (ignore schemaId)
-    sig = _signal_type(alert)
-    app.logger.info(f"[/alerts/adf] signalType: {sig}")
-    print("[/alerts/adf] signalType:", sig)
-    triage_ctx = None
-    if sig == "metric":
-        triage_ctx = _from_metric_alert(alert)
-    elif sig == ("log","platform"):
-        triage_ctx = _from_kql_alert(alert)
-    elif sig == "activitylog":
-        # If you later support Activity Log alerts explicitly, parse here.
-        triage_ctx = _from_kql_alert(alert)  # reuse until you add a dedicated parser
-    else:
-        # Accept compact client/test payloads too
-        if ("pipeline_name" in alert) or ("pipelineName" in alert):
-            triage_ctx = {
-                "subscription_id": alert.get("subscription_id"),
-                "resource_group":  alert.get("resource_group"),
-                "factory_name":    alert.get("factory_name"),
-                "pipeline_name":   alert.get("pipeline_name") or alert.get("pipelineName"),
-                "run_id":          alert.get("run_id") or alert.get("runId"),
-            }
+    with span("alert.parse"):
+        # Determine alert flavor robustly (ignore schemaId)
+        sig = _signal_type(alert)
+        app.logger.info(f"[/alerts/adf] signalType: {sig}")
+        print("[/alerts/adf] signalType:", sig)
+        triage_ctx = None
+        if sig == "metric":
+            triage_ctx = _from_metric_alert(alert)
+        elif sig == ("log","platform"):
+            triage_ctx = _from_kql_alert(alert)
+        elif sig == "activitylog":
+            # If you later support Activity Log alerts explicitly, parse here.
+            triage_ctx = _from_kql_alert(alert)  # reuse until you add a dedicated parser
+        else:
+            # Accept compact client/test payloads too
+            if ("pipeline_name" in alert) or ("pipelineName" in alert):
+                triage_ctx = {
+                    "subscription_id": alert.get("subscription_id"),
+                    "resource_group":  alert.get("resource_group"),
+                    "factory_name":    alert.get("factory_name"),
+                    "pipeline_name":   alert.get("pipeline_name") or alert.get("pipelineName"),
+                    "run_id":          alert.get("run_id") or alert.get("runId"),
+                }
+        tracing.set_attribute("alert.signal_type", sig)
+    if triage_ctx:
+        tracing.set_attribute("adf.pipeline", triage_ctx.get("pipeline_name"))
+        tracing.set_attribute("adf.factory", triage_ctx.get("factory_name"))
     # accept compact manual payloads too
     if not triage_ctx:
         app.logger.info("[/alerts/adf] Unrecognized shape; returning 202.")        
@@ -286,7 +338,7 @@ def handle_adf_alert():
                 attempt=0,
                 pipeline_name="unknown",
                 why=f"unrecognized alert shape (signalType={sig})",
-                context_json=json.dumps({"alert": alert})[:32000],
+                context_json=json.dumps({"alert": alert}),
             )
         except Exception as ex:
             app.logger.warning(f"save_decision failed: {ex}")
@@ -294,22 +346,49 @@ def handle_adf_alert():
 
   
 
+    # Per factory/pipeline admission: a flapping pipeline must not starve everyone else
+    allowed, retry_after = admission.alerts.allow(admission.alert_key(triage_ctx))
+    tracing.set_attribute("admission.throttled", not allowed)
+    if not allowed:
+        if admission.ALERT_SHED_MODE == "reject":
+            admission.count("alerts:rejected")
+            return jsonify({"status": "throttled", "retryAfter": retry_after}), 429, {"Retry-After": str(retry_after)}
+        # downgrade: heuristic only, record it, and don't start another orchestration
+        admission.count("alerts:downgraded")
+        classification = _heuristic(triage_ctx, alert)
+        try:
+            save_decision(
+                conversation_id=triage_ctx.get("run_id") or triage_ctx.get("pipeline_name") or "unknown",
+                agent="sre",
+                category=classification.get("category"),
+                action="throttled",
+                attempt=0,
+                pipeline_name=triage_ctx.get("pipeline_name"),
+                why=f"rate limited; heuristic: {classification.get('why')}",
+                context_json=json.dumps({"alert": alert, "context": triage_ctx}),
+            )
+        except Exception as ex:
+            app.logger.warning(f"save_decision failed: {ex}")
+        return jsonify({"status": "throttled", "route": "notify", "classification": classification}), 202
+
     # AOAI classification (with fallback)
     classification = _classify_with_aoai(alert, triage_ctx)
-    try:
-        save_decision(
-            conversation_id=triage_ctx.get("run_id") or triage_ctx.get("pipeline_name") or "unknown",
-            agent="sre",
-            category=classification.get("category"),
-            action="classified",
-            attempt=0,
-            pipeline_name=triage_ctx.get("pipeline_name"),
-            why=classification.get("why"),
-            context_json=json.dumps({"alert": alert, "context": triage_ctx})[:32000],
-        )
-    except Exception as ex:
-        app.logger.warning(f"save_decision failed: {ex}")   
     print("classification done")
+
+    def _record_classified():
+        try:
+            save_decision(
+                conversation_id=triage_ctx.get("run_id") or triage_ctx.get("pipeline_name") or "unknown",
+                agent="sre",
+                category=classification.get("category"),
+                action="classified",
+                attempt=0,
+                pipeline_name=triage_ctx.get("pipeline_name"),
+                why=classification.get("why"),
+                context_json=json.dumps({"alert": alert, "context": triage_ctx}),
+            )
+        except Exception as ex:
+            app.logger.warning(f"save_decision failed: {ex}")
     
     # Decide routing
     go_to_sre = bool(classification.get("retryable")) or classification.get("category") == "FileNotFound"
@@ -317,6 +396,8 @@ def handle_adf_alert():
         triage_event = {
             "source": "azure-monitor",
             "receivedAt": dt.datetime.utcnow().isoformat() + "Z",
+            "correlationId": tracing.current_trace_id(),
+            "traceparent": tracing.traceparent(),
             "context": {
                 **triage_ctx,
                 "expected_path": classification.get("expected_path"),
@@ -327,14 +408,22 @@ def handle_adf_alert():
         }
         try:
             print("[/alerts/adf] posting to Agent-SRE…")
-            result = start_sre_triage(triage_event)
+            with admission.upstream_slot("sre-triage"):
+                # recorded only once a slot is held: a shed alert gets a 429 and Action Groups
+                # retry it, so saving before that would store (and count) it once per retry
+                _record_classified()
+                result = start_sre_triage(triage_event)
             print(f"[/alerts/adf] Agent-SRE accepted: {result}")
             return jsonify({"status": "queued", "route": "agent-sre", "result": result}), 202
+        except admission.Overloaded as ex:
+            # Action Groups retry 429s, so the orchestration is started later rather than dropped
+            return jsonify({"status": "throttled", "route": "agent-sre", "retryAfter": ex.retry_after}), 429, {"Retry-After": str(ex.retry_after)}
         except Exception as ex:
             print(f"[/alerts/adf] Agent-SRE forward error: {ex}")
             return jsonify({"status": "accepted", "route": "agent-sre", "forwardError": str(ex)}), 202
 
     # Non-retryable → notify (Teams/Email handled by your Action Group/Logic App)
+    _record_classified()
     print("[/alerts/adf] non-retryable; notifying only.")
     return jsonify({"status": "accepted", "route": "notify", "classification": classification}), 202
 
@@ -348,7 +437,6 @@ def handle_adf_alert():
 
 # Azure Resource Graph helpers
 def get_arg_counts(limit: int = 20) -> list[dict]:
-    _cred = DefaultAzureCredential(exclude_interactive_browser_credential=False)
     SUB = os.getenv("SUBSCRIPTION_ID")
     KQL = """
     resources
@@ -357,8 +445,10 @@ def get_arg_counts(limit: int = 20) -> list[dict]:
     | order by count desc
     """
     try:
-        cl = ResourceGraphClient(credential=_cred)
-        req = QueryRequest(subscriptions=[SUB], query=KQL)
+        arg = startup.import_timed("azure.mgmt.resourcegraph")
+        arg_models = startup.import_timed("azure.mgmt.resourcegraph.models")
+        cl = arg.ResourceGraphClient(credential=credential())
+        req = arg_models.QueryRequest(subscriptions=[SUB], query=KQL)
         res = cl.resources(req)
         rows = res.data or []
         items = [{"product": r[0], "count": int(r[1])} for r in rows]
@@ -375,8 +465,8 @@ def _read_tfstate() -> dict | None:
     try:
         if not (ACC and CON and BLOB):
             return None
-        _cred = DefaultAzureCredential(exclude_interactive_browser_credential=False)
-        bc = BlobClient(account_url=f"https://{ACC}.blob.core.windows.net", container_name=CON, blob_name=BLOB, credential=_cred)
+        BlobClient = startup.import_timed("azure.storage.blob").BlobClient
+        bc = BlobClient(account_url=f"https://{ACC}.blob.core.windows.net", container_name=CON, blob_name=BLOB, credential=credential())
         if not bc.exists():
             return None
         data = bc.download_blob(max_concurrency=1).readall()
@@ -410,6 +500,11 @@ def get_tf_counts() -> dict[str, int]:
         counts[product] += len(instances) if instances else 1
     return dict(counts)
 
+def _arg_half_present(items: list[dict]) -> bool:
+    # get_arg_counts returns [] on error; a Terraform-only overlay is degraded, don't pin it
+    return any(i.get("azure_total") for i in items)
+
+@cached("resources", ttl=RESOURCES_CACHE_TTL, cache_if=_arg_half_present)
 def top_products_with_overlay(limit: int = 12) -> list[dict]:
     arg = get_arg_counts(limit=100)
     tf = get_tf_counts()
@@ -429,13 +524,9 @@ def top_products_with_overlay(limit: int = 12) -> list[dict]:
 
 # Azure Table Storage helpers
 def last_decisions(limit: int = 20) -> list[dict]:
-    ACCOUNT_URL = os.getenv("STORAGE_ACCOUNT_URL")
-    TABLE_DECISIONS = os.getenv("TABLE_DECISIONS", "AgentDecisions")
     try:
-        _cred = DefaultAzureCredential(exclude_interactive_browser_credential=False)
-        _svc = TableServiceClient(endpoint=ACCOUNT_URL, credential=_cred)
-        _dec = _svc.get_table_client(TABLE_DECISIONS)
-        rows = list(_dec.list_entities(results_per_page=limit * 5))
+        _dec = get_table(TABLE_DECISIONS)
+        rows = list(_dec.list_entities(results_per_page=limit * 5, select=DECISION_LIST_SELECT))
         rows.sort(key=lambda e: e.get("createdAt", ""), reverse=True)
         out = []
         for e in rows[:limit]:
@@ -443,11 +534,13 @@ def last_decisions(limit: int = 20) -> list[dict]:
                 "createdAt": e.get("createdAt"),
                 "pipeline": e.get("PartitionKey"),
                 "run_id": e.get("RowKey"),
+                "row_key": e.get("RowKey"),
                 "agent": "sre",
                 "category": e.get("category"),
                 "action": e.get("action"),
                 "attempt": 0,
-                "context": e.get("payload") or e.get("contextJson"),
+                "contextSize": e.get("contextSize"),
+                "contextOffloaded": bool(e.get("contextBlob")),
             })
         return out
     except Exception as ex:
@@ -473,6 +566,29 @@ def api_sre_actions():
     items = list_decisions(pipeline=pipeline, top=top)
     return jsonify(items), 200
 
+@app.get("/api/sre/stats")
+def api_sre_stats():
+    """Rollup time series, e.g. /api/sre/stats?grain=hour&window=24&dim=pipeline_category&pipeline=p1"""
+    from utils.rollups import query_stats
+    try:
+        data = query_stats(
+            grain=request.args.get("grain", "hour"),
+            dim=request.args.get("dim", "category"),
+            window=int(request.args.get("window", 24)),  # validated (>= 1, capped) by query_stats
+            pipeline=request.args.get("pipeline"),
+        )
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    return jsonify(data), 200
+
+@app.get("/api/sre/decisions/<pipeline>/<row_key>")
+def api_sre_decision_detail(pipeline: str, row_key: str):
+    # full context is only materialized here (offloaded contexts are fetched from blob)
+    item = get_decision(pipeline, row_key)
+    if item is None:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(item), 200
+
 @app.route("/")
 def dashboard():
     print("I am home ")
@@ -481,20 +597,46 @@ def dashboard():
 
 @app.get("/healthz")
 def healthz():
-    return {"ok": True, "template_dir": TEMPLATE_CANDIDATE}, 200
+    ready = startup.is_ready()
+    code = 200 if ready or not startup.WARMUP_GATES_HEALTH else 503
+    return {"ok": ready, "warmup": startup.warmup_state(), "template_dir": TEMPLATE_CANDIDATE}, code
+
+@app.get("/api/startup")
+def api_startup():
+    return jsonify(startup.report()), 200
 
 @app.get("/health")
 def health():
     return {"ok": True, "service": "saude-app"}, 200
 
+@app.get("/api/cache/stats")
+def api_cache_stats():
+    return jsonify(cache.stats()), 200
+
+@app.get("/api/admission/stats")
+def api_admission_stats():
+    return jsonify(admission.stats()), 200
+
+def _admit_proxy():
+    """None if the caller may proceed, else a 429 response."""
+    allowed, retry_after = admission.proxies.allow(admission.caller_key(request))
+    if allowed:
+        return None
+    return jsonify({"error": "rate limited", "retryAfter": retry_after}), 429, {"Retry-After": str(retry_after)}
+
 # Pretty façade -> Functions (absolute URLs required)
 @app.post("/agent-sre/api/triage")
+@tracing.traced("POST /agent-sre/api/triage")
 def proxy_sre():
+    throttled = _admit_proxy()
+    if throttled:
+        return throttled
     payload = request.get_json(force=True)
     start_time = dt.datetime.utcnow()
     try:
-        with httpx.Client(timeout=60) as c:
-            r = c.post(AGENT_SRE_FUNC_URL, json=payload, headers=functions_auth_headers("sre"))
+        with admission.upstream_slot("sre"), httpx.Client(timeout=60) as c, \
+                span("functions.sre", kind=tracing.KIND_CLIENT):
+            r = c.post(AGENT_SRE_FUNC_URL, json=payload, headers={**functions_auth_headers("sre"), **tracing.propagation_headers()})
             end_time = dt.datetime.utcnow()
             duration = (end_time - start_time).total_seconds() * 1000
             save_api_log(endpoint="/agent-sre/api/triage", method="POST", status_code=r.status_code, duration_ms=duration, payload=payload, response=r.json())
@@ -504,6 +646,8 @@ def proxy_sre():
         duration = (end_time - start_time).total_seconds() * 1000
         save_api_log(endpoint="/agent-sre/api/triage", method="POST", status_code=e.response.status_code, duration_ms=duration, payload=payload, response={"error": str(e)})
         return jsonify({"error": str(e)}), e.response.status_code
+    except admission.Overloaded as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
     except Exception as e:
         end_time = dt.datetime.utcnow()
         duration = (end_time - start_time).total_seconds() * 1000
@@ -511,12 +655,17 @@ def proxy_sre():
         return jsonify({"error": str(e)}), 500    
 
 @app.post("/agent-info/api/route")
+@tracing.traced("POST /agent-info/api/route")
 def proxy_info():
+    throttled = _admit_proxy()
+    if throttled:
+        return throttled
     payload = request.get_json(force=True)
     start_time = dt.datetime.utcnow()
     try:
-        with httpx.Client(timeout=60) as c:
-            r = c.post(AGENT_INFO_FUNC_URL, json=payload, headers=functions_auth_headers("info"))
+        with admission.upstream_slot("info"), httpx.Client(timeout=60) as c, \
+                span("functions.info", kind=tracing.KIND_CLIENT):
+            r = c.post(AGENT_INFO_FUNC_URL, json=payload, headers={**functions_auth_headers("info"), **tracing.propagation_headers()})
             end_time = dt.datetime.utcnow()
             duration = (end_time - start_time).total_seconds() * 1000
             save_api_log(endpoint="/agent-info/api/route", method="POST", status_code=r.status_code, duration_ms=duration, payload=payload, response=r.json())
@@ -526,6 +675,8 @@ def proxy_info():
         duration = (end_time - start_time).total_seconds() * 1000
         save_api_log(endpoint="/agent-info/api/route", method="POST", status_code=e.response.status_code, duration_ms=duration, payload=payload, response={"error": str(e)})
         return jsonify({"error": str(e)}), e.response.status_code
+    except admission.Overloaded as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
     except Exception as e:
         end_time = dt.datetime.utcnow()
         duration = (end_time - start_time).total_seconds() * 1000
@@ -534,13 +685,20 @@ def proxy_info():
 
 
 # Durable status (for dashboard)
-@app.get("/status/<instance_id>")
-def get_status(instance_id: string):
+@cached("durable-status", ttl=STATUS_CACHE_TTL, cache_if=lambda snap: snap[1] == 200)
+def _durable_status(instance_id: str) -> list:
     url = f"{AGENT_SRE_DURABLE_BASE}/{instance_id}"
     params = {"showHistory": "true"}
-    with httpx.Client(timeout=20) as c:
+    with admission.upstream_slot("durable-status"), httpx.Client(timeout=20) as c:
         r = c.get(url, params=params, headers=functions_auth_headers("sre"))
-        return (r.text, r.status_code, {"Content-Type": r.headers.get("Content-Type", "application/json")})
+        return [r.text, r.status_code, {"Content-Type": r.headers.get("Content-Type", "application/json")}]
+
+@app.get("/status/<instance_id>")
+def get_status(instance_id: string):
+    try:
+        return tuple(_durable_status(instance_id))
+    except admission.Overloaded as ex:
+        return jsonify({"error": str(ex)}), 503, {"Retry-After": str(ex.retry_after)}
 @app.get("/api/logs/actions")
 def api_logs_actions():
     top = int(request.args.get("top", 50))
@@ -548,43 +706,73 @@ def api_logs_actions():
     return jsonify({"items": items})
 
 # ============================================================================ #
-#         Minimal chat stub                                                    #
+#         Chat (SSE streaming)                                                 #
 # ============================================================================ #
 
+CHAT_HELP = "How can I help? (try 'triage' or 'list vms')"
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.post("/chat")
-def chat_stub():
+def chat_stream():
+    """Streams the reply as server-sent events: `delta` chunks, then `done` (or `error`)."""
     body = request.get_json(force=True)
     conversation_id = body.get("conversation_id", "default-conv")
     user_msg = body.get("message", "")
 
-    save_message(conversation_id, "user", user_msg)
-
-    # DEMO: triage
-    if "triage" in user_msg.lower():
-        payload = {
-            "subscription_id": "<subid>",
-            "resource_group": "<rg>",
-            "factory_name": "<adf>",
-            "run_id": "<runid>",
-            "pipeline_name": "<pipeline>",
-            "expected_path": None
-        }
-        data = start_sre_triage(payload)
-        save_message(conversation_id, "assistant", f"Triage started: {data}")
-        return jsonify({"reply": f"Triage started: {data}"})
-
-    # DEMO: inventory
-    if "list vms" in user_msg.lower():
-        payload = {"op": "list_vms", "filter": "tags.env =~ 'prod'"}
-        data = agent_info_request(payload)  # fixed: call Agent-Info helper
-        save_message(conversation_id, "assistant", json.dumps(data)[:1000])
-        return jsonify({"reply": data})
+    def generate():
+        # DEMO: triage
+        if "triage" in user_msg.lower():
+            chat.remember(conversation_id, "user", user_msg)
+            payload = {
+                "subscription_id": "<subid>",
+                "resource_group": "<rg>",
+                "factory_name": "<adf>",
+                "run_id": "<runid>",
+                "pipeline_name": "<pipeline>",
+                "expected_path": None
+            }
+            with admission.upstream_slot("sre-triage"):
+                reply = f"Triage started: {start_sre_triage(payload)}"
+            chat.remember(conversation_id, "assistant", reply)
+            yield _sse("delta", {"text": reply})
+        # DEMO: inventory
+        elif "list vms" in user_msg.lower():
+            chat.remember(conversation_id, "user", user_msg)
+            with admission.upstream_slot("info"):
+                reply = json.dumps(agent_info_request({"op": "list_vms", "filter": "tags.env =~ 'prod'"}))
+            chat.remember(conversation_id, "assistant", reply[:1000])
+            yield _sse("delta", {"text": reply})
+        elif chat.aoai_configured():
+            for delta in chat.stream_reply(conversation_id, user_msg):
+                yield _sse("delta", {"text": delta})
+        else:
+            chat.remember(conversation_id, "user", user_msg)
+            chat.remember(conversation_id, "assistant", CHAT_HELP)
+            yield _sse("delta", {"text": CHAT_HELP})
+        yield _sse("done", {"conversation_id": conversation_id})
+
+    def guarded():
+        try:
+            yield from generate()
+        except admission.Overloaded as ex:
+            yield _sse("error", {"error": "The agent is busy, please retry shortly.", "retryAfter": ex.retry_after})
+        except Exception as ex:
+            print(f"[/chat] stream error: {ex}")
+            yield _sse("error", {"error": str(ex)})
 
-    save_message(conversation_id, "assistant", "How can I help? (try 'triage' or 'list vms')")
-    return jsonify({"reply": "How can I help? (try 'triage' or 'list vms')"})
+    return Response(
+        stream_with_context(guarded()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # ============================================================================ #
 
+startup.mark_app_ready()
+startup.start_warmup()
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,186 @@
+# saude-app/utils/admission.py
+"""Per-key rate limiting and a global cap on in-flight upstream calls.
+
+- `alerts`  : token bucket per factory/pipeline for /alerts/adf
+- `proxies` : token bucket per caller for the /agent-* proxies
+- `upstream_slot()` : bounds concurrent calls to AOAI / the Functions
+                      (classification, triage, proxies, Durable status)
+- `chat_slot()`     : a separate, smaller cap for streaming chat completions,
+                      which hold their call open for the whole reply and so
+                      must not eat into the slots the alert path needs
+
+Limits are per worker (gunicorn workers don't share memory), so the
+effective ceiling is roughly the configured value x number of workers.
+"""
+import os
+import time
+import math
+import threading
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from typing import Dict, Any, Tuple
+
+ALERT_RATE_PER_MIN    = float(os.getenv("ALERT_RATE_PER_MIN", "6"))     # sustained alerts per factory/pipeline
+ALERT_BURST           = int(os.getenv("ALERT_BURST", "5"))
+ALERT_SHED_MODE       = os.getenv("ALERT_SHED_MODE", "heuristic").lower()  # heuristic | reject
+PROXY_RATE_PER_MIN    = float(os.getenv("PROXY_RATE_PER_MIN", "60"))    # per caller
+PROXY_BURST           = int(os.getenv("PROXY_BURST", "20"))
+UPSTREAM_MAX_INFLIGHT = int(os.getenv("UPSTREAM_MAX_INFLIGHT", "16"))
+UPSTREAM_WAIT_SECONDS = float(os.getenv("UPSTREAM_WAIT_SECONDS", "2"))
+CHAT_MAX_INFLIGHT     = int(os.getenv("CHAT_MAX_INFLIGHT", "4"))        # concurrent chat streams
+MAX_TRACKED_KEYS      = int(os.getenv("ADMISSION_MAX_KEYS", "10000"))
+# App Service sets WEBSITE_AUTH_ENABLED when Easy Auth is on; only then is the principal header trustworthy
+EASY_AUTH_ENABLED     = os.getenv("WEBSITE_AUTH_ENABLED", "false").lower() == "true"
+
+
+class Overloaded(Exception):
+    """Raised when no upstream slot frees up in time."""
+
+    def __init__(self, retry_after: int = 1, limit: int = UPSTREAM_MAX_INFLIGHT):
+        super().__init__(f"upstream concurrency cap reached ({limit})")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, burst: int):
+        self.rate = rate_per_sec
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> Tuple[bool, int]:
+        """(allowed, retry_after_seconds)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0
+        if self.rate <= 0:
+            return False, 60
+        return False, max(1, math.ceil((1 - self.tokens) / self.rate))
+
+
+class KeyedLimiter:
+    """One token bucket per key; least-recently-seen keys are dropped past MAX_TRACKED_KEYS."""
+
+    def __init__(self, name: str, rate_per_min: float, burst: int):
+        self.name = name
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+        self.throttled_by_key: Counter = Counter()
+
+    def allow(self, key: str) -> Tuple[bool, int]:
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                b = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                while len(self._buckets) > MAX_TRACKED_KEYS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            ok, retry_after = b.take()
+            if ok:
+                self.allowed += 1
+            else:
+                self.throttled += 1
+                self.throttled_by_key[key] += 1
+                if len(self.throttled_by_key) > MAX_TRACKED_KEYS:
+                    self.throttled_by_key = Counter(dict(self.throttled_by_key.most_common(100)))
+            return ok, retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rate_per_min": self.rate * 60,
+                "burst": self.burst,
+                "tracked_keys": len(self._buckets),
+                "allowed": self.allowed,
+                "throttled": self.throttled,
+                "top_throttled": dict(self.throttled_by_key.most_common(10)),
+            }
+
+
+alerts = KeyedLimiter("alerts", ALERT_RATE_PER_MIN, ALERT_BURST)
+proxies = KeyedLimiter("proxies", PROXY_RATE_PER_MIN, PROXY_BURST)
+
+_sem = threading.BoundedSemaphore(UPSTREAM_MAX_INFLIGHT)
+_chat_sem = threading.BoundedSemaphore(CHAT_MAX_INFLIGHT)
+_counters: Counter = Counter()
+_counters_lock = threading.Lock()
+_inflight: Counter = Counter()  # pool -> calls in flight
+
+
+def count(name: str) -> None:
+    with _counters_lock:
+        _counters[name] += 1
+
+
+@contextmanager
+def _slot(sem: threading.BoundedSemaphore, limit: int, pool: str, kind: str):
+    if not sem.acquire(timeout=UPSTREAM_WAIT_SECONDS):
+        count(f"shed:{kind}")
+        raise Overloaded(retry_after=max(1, math.ceil(UPSTREAM_WAIT_SECONDS)), limit=limit)
+    with _counters_lock:
+        _inflight[pool] += 1
+        peak = f"{pool}_inflight_peak"
+        _counters[peak] = max(_counters[peak], _inflight[pool])
+    try:
+        yield
+    finally:
+        with _counters_lock:
+            _inflight[pool] -= 1
+        sem.release()
+
+
+def upstream_slot(kind: str = "upstream"):
+    """Hold one of UPSTREAM_MAX_INFLIGHT slots for the duration of an upstream call."""
+    return _slot(_sem, UPSTREAM_MAX_INFLIGHT, "upstream", kind)
+
+
+def chat_slot(kind: str = "aoai-chat"):
+    """Hold one of CHAT_MAX_INFLIGHT slots for a chat stream; separate from upstream_slot."""
+    return _slot(_chat_sem, CHAT_MAX_INFLIGHT, "chat", kind)
+
+
+def alert_key(triage_ctx: dict) -> str:
+    return f"{triage_ctx.get('factory_name') or 'unknown'}/{triage_ctx.get('pipeline_name') or 'unknown'}"
+
+
+def _strip_port(ip: str) -> str:
+    if ip.startswith("["):  # [ipv6]:port
+        return ip[1:].split("]")[0]
+    if ip.count(":") == 1:  # ipv4:port
+        return ip.split(":")[0]
+    return ip
+
+
+def caller_key(req) -> str:
+    """Easy Auth principal (only when Easy Auth is enabled), else the client IP as seen
+    by the App Service front end: X-Client-IP, or the rightmost X-Forwarded-For entry.
+    Leftmost X-Forwarded-For entries come from the client and are not trusted."""
+    principal = req.headers.get("X-MS-CLIENT-PRINCIPAL-ID")
+    if principal and EASY_AUTH_ENABLED:
+        return f"principal:{principal}"
+    ip = (req.headers.get("X-Client-IP") or "").strip()
+    if not ip:
+        ip = (req.headers.get("X-Forwarded-For") or "").split(",")[-1].strip()
+    return f"ip:{_strip_port(ip or req.remote_addr or 'unknown')}"
+
+
+def stats() -> Dict[str, Any]:
+    with _counters_lock:
+        counters = dict(_counters)
+        inflight = dict(_inflight)
+    return {
+        "pid": os.getpid(),
+        "alerts": {**alerts.stats(), "shed_mode": ALERT_SHED_MODE},
+        "proxies": proxies.stats(),
+        "upstream": {"max_inflight": UPSTREAM_MAX_INFLIGHT, "inflight": inflight.get("upstream", 0)},
+        "chat": {"max_inflight": CHAT_MAX_INFLIGHT, "inflight": inflight.get("chat", 0)},
+        "counters": counters,
+    }
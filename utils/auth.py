@@ -1,11 +1,23 @@
 import os
-from azure.identity import ManagedIdentityCredential, DefaultAzureCredential
+import threading
+from .startup import import_timed
 
 USE_AAD = os.getenv("USE_AAD_FOR_FUNCS", "false").lower() == "true"
 FUNC_APP_APP_ID_URI = os.getenv("FUNC_APP_APP_ID_URI")
 
-_cred = DefaultAzureCredential(exclude_interactive_browser_credential=False)
-_mi_cred = ManagedIdentityCredential()
+# Credentials are built on first use (azure.identity is slow to import and
+# nothing needs it until a route does); one instance per worker keeps its token cache.
+_cred = None
+_lock = threading.Lock()
+
+def credential():
+    """Shared DefaultAzureCredential for this worker."""
+    global _cred
+    if _cred is None:
+        with _lock:
+            if _cred is None:
+                _cred = import_timed("azure.identity").DefaultAzureCredential(exclude_interactive_browser_credential=False)
+    return _cred
 
 def functions_auth_headers(kind: str):
     """Return headers to call Function Apps securely.
@@ -13,9 +25,10 @@ def functions_auth_headers(kind: str):
     Otherwise attach function key header from env/Key Vault.
     """
     if USE_AAD and FUNC_APP_APP_ID_URI:
-        token = _cred.get_token(FUNC_APP_APP_ID_URI).token
+        from .cache import get_token
+        token = get_token(credential(), FUNC_APP_APP_ID_URI)
         return {"Authorization": f"Bearer {token}"}
 
     key_env = "FUNC_KEY_SRE_SECRET" if kind == "sre" else "FUNC_KEY_INFO_SECRET"
     key = os.getenv(key_env)
-    return {"x-functions-key": key} if key else {}
\ No newline at end of file
+    return {"x-functions-key": key} if key else {}
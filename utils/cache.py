@@ -0,0 +1,225 @@
+# saude-app/utils/cache.py
+"""Two-tier cache for the app's memoized lookups.
+
+    memory  - per-worker LRU dict (fastest, not shared)
+    shared  - SQLite file on local disk, shared by every gunicorn worker on the host
+
+A miss in memory falls through to the shared tier and back-fills memory with
+the remaining TTL, so a value fetched by one worker is warm for the others.
+Values must be JSON-serializable. Both tiers are size-bounded and keep
+hit/miss/eviction counters (per worker) for /api/cache/stats.
+
+CACHE_BACKEND=tiered (default) | memory | off
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Optional, Tuple
+
+log = logging.getLogger("utils.cache")
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "tiered").lower()
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv("CACHE_MEMORY_MAX_ENTRIES", "1024"))
+CACHE_SHARED_MAX_ENTRIES = int(os.getenv("CACHE_SHARED_MAX_ENTRIES", "20000"))
+CACHE_SHARED_PATH = os.getenv("CACHE_SHARED_PATH", os.path.join(tempfile.gettempdir(), "saude-cache.sqlite"))
+
+_MISS = (False, None, 0.0)
+
+
+class _Stats:
+    def __init__(self):
+        self.hits = self.misses = self.sets = self.evictions = self.errors = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "sets": self.sets, "evictions": self.evictions,
+                "errors": self.errors, "hit_ratio": round(self.hits / total, 3) if total else None}
+
+
+class MemoryTier:
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = _Stats()
+
+    def get(self, key: str) -> Tuple[bool, Any, float]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.time():
+                if item is not None:
+                    del self._data[key]
+                self.stats.misses += 1
+                return _MISS
+            self._data.move_to_end(key)
+            self.stats.hits += 1
+            return True, item[1], item[0]
+
+    def set(self, key: str, value: Any, expires: float) -> None:
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            self.stats.sets += 1
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats.evictions += 1
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class SqliteTier:
+    """Shared across processes via a WAL-mode SQLite file; one connection per thread."""
+    name = "shared"
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._sets_since_sweep = 0
+        self.stats = _Stats()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():  # never reuse across fork
+            old_umask = os.umask(0o077)  # may hold access tokens: owner-only
+            try:
+                conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            finally:
+                os.umask(old_umask)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache(expires)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> Tuple[bool, Any, float]:
+        try:
+            row = self._conn().execute("SELECT value, expires FROM cache WHERE key = ? AND expires > ?",
+                                       (key, time.time())).fetchone()
+        except sqlite3.Error as ex:
+            self.stats.errors += 1
+            log.debug(f"shared cache get failed: {ex}")
+            return _MISS
+        if row is None:
+            self.stats.misses += 1
+            return _MISS
+        self.stats.hits += 1
+        return True, json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires: float) -> None:
+        try:
+            conn = self._conn()
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), expires))
+            self.stats.sets += 1
+            self._sets_since_sweep += 1
+            if self._sets_since_sweep >= 100:
+                self._sets_since_sweep = 0
+                self._sweep(conn)
+        except (sqlite3.Error, TypeError, ValueError) as ex:
+            self.stats.errors += 1
+            log.debug(f"shared cache set failed: {ex}")
+
+    def _sweep(self, conn: sqlite3.Connection) -> None:
+        """Drop expired rows, then the soonest-to-expire ones beyond max_entries."""
+        n = conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),)).rowcount
+        over = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if over > 0:
+            n += conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?)",
+                              (over,)).rowcount
+        self.stats.evictions += max(n, 0)
+
+    def size(self) -> Optional[int]:
+        try:
+            return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+
+class TieredCache:
+    def __init__(self, tiers):
+        self.tiers = tiers
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        for i, tier in enumerate(self.tiers):
+            hit, value, expires = tier.get(key)
+            if hit:
+                for upper in self.tiers[:i]:  # back-fill faster tiers
+                    upper.set(key, value, expires)
+                return True, value
+        return False, None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        expires = time.time() + ttl
+        for tier in self.tiers:
+            tier.set(key, value, expires)
+
+    def tier(self, name: str):
+        """The tier called `name` ("memory" / "shared"), or None if it is not configured."""
+        return next((t for t in self.tiers if t.name == name), None)
+
+    def get_or_set(self, key: str, fn: Callable[[], Any], ttl: float,
+                   cache_if: Optional[Callable[[Any], bool]] = None) -> Any:
+        hit, value = self.get(key)
+        if hit:
+            return value
+        value = fn()
+        if cache_if is None or cache_if(value):
+            self.set(key, value, ttl)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": CACHE_BACKEND, "pid": os.getpid(),
+                "tiers": {t.name: {**t.stats.as_dict(), "entries": t.size()} for t in self.tiers}}
+
+
+def _build() -> TieredCache:
+    if CACHE_BACKEND == "off":
+        return TieredCache([])
+    tiers = [MemoryTier(CACHE_MEMORY_MAX_ENTRIES)]
+    if CACHE_BACKEND == "tiered":
+        tiers.append(SqliteTier(CACHE_SHARED_PATH, CACHE_SHARED_MAX_ENTRIES))
+    return TieredCache(tiers)
+
+
+cache = _build()
+
+
+def make_key(namespace: str, *parts: Any) -> str:
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+    return f"{namespace}:{digest}"
+
+
+def cached(namespace: str, ttl: float, cache_if: Optional[Callable[[Any], bool]] = None):
+    """Memoize a function in the tiered cache, keyed by its arguments."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = make_key(namespace, args, kwargs)
+            return cache.get_or_set(key, lambda: fn(*args, **kwargs), ttl, cache_if)
+        return wrapper
+    return deco
+
+
+def get_token(credential, scope: str, margin: float = 300) -> str:
+    """Bearer token for `scope`, shared across workers until `margin` seconds before expiry."""
+    key = f"token:{scope}"
+    hit, tok = cache.get(key)
+    if hit:
+        return tok
+    at = credential.get_token(scope)
+    cache.set(key, at.token, at.expires_on - time.time() - margin)
+    return at.token
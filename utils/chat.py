@@ -0,0 +1,215 @@
+# saude-app/utils/chat.py
+"""Streaming chat over Azure OpenAI with an in-memory history cache.
+
+History for recent conversations lives in this worker's memory and is served
+from there. Each write also stamps the conversation's newest RowKey in the
+shared cache tier, so a worker only re-reads the table tail when another worker
+on the host has moved the conversation on, or after CHAT_HISTORY_SYNC_SECONDS
+(which covers other instances). Messages are written to the table in the
+background, in order, once a reply finishes.
+"""
+from __future__ import annotations
+import os
+import logging
+import time
+import threading
+import datetime as dt
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, TYPE_CHECKING
+
+if TYPE_CHECKING:  # openai is imported on the first chat turn, not at worker start
+    from openai import AzureOpenAI
+
+from .storage import save_message, list_messages, MESSAGE_RK_FORMAT
+from . import admission
+from .startup import import_timed
+from .cache import cache
+
+log = logging.getLogger("utils.chat")
+
+AOAI_ENDPOINT    = (os.getenv("AOAI_ENDPOINT") or "").rstrip("/")
+AOAI_DEPLOYMENT  = os.getenv("AOAI_DEPLOYMENT", "gpt-4o-mini")
+AOAI_API_VERSION = os.getenv("AOAI_API_VERSION", "2024-02-15-preview")
+AOAI_API_KEY     = os.getenv("AOAI_API_KEY")
+
+AOAI_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+CHAT_HISTORY_MESSAGES = int(os.getenv("CHAT_HISTORY_MESSAGES", "20"))         # per conversation
+CHAT_HISTORY_CONVERSATIONS = int(os.getenv("CHAT_HISTORY_CONVERSATIONS", "500"))  # per worker
+CHAT_HISTORY_SYNC_SECONDS = float(os.getenv("CHAT_HISTORY_SYNC_SECONDS", "60"))  # tail re-read at most this often
+CHAT_MAX_TOKENS = int(os.getenv("CHAT_MAX_TOKENS", "800"))
+
+SYSTEM_PROMPT = (
+    "You are SAUDE, an SRE assistant for Azure Data Factory pipelines. "
+    "Answer concisely. When the user wants a failed run triaged, tell them to type 'triage'; "
+    "for a VM inventory, 'list vms'."
+)
+
+_client: "AzureOpenAI | None" = None
+_client_lock = threading.Lock()
+
+
+def aoai_configured() -> bool:
+    return bool(AOAI_ENDPOINT and AOAI_DEPLOYMENT)
+
+
+def _aoai_client() -> "AzureOpenAI":
+    """One client per worker so the HTTP connection pool is reused across turns."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            AzureOpenAI = import_timed("openai").AzureOpenAI
+            if AOAI_API_KEY:
+                _client = AzureOpenAI(api_key=AOAI_API_KEY, azure_endpoint=AOAI_ENDPOINT,
+                                      api_version=AOAI_API_VERSION)
+            else:
+                from .auth import credential
+                provider = import_timed("azure.identity").get_bearer_token_provider(credential(), AOAI_SCOPE)
+                _client = AzureOpenAI(azure_ad_token_provider=provider, azure_endpoint=AOAI_ENDPOINT,
+                                      api_version=AOAI_API_VERSION)
+        return _client
+
+
+# ---------- history cache ----------
+class _History:
+    """LRU of conversation_id -> last N messages, read through to the Messages table.
+
+    A cached conversation is served from memory. The table tail (messages after
+    the newest RowKey this worker has seen) is only read when the shared-tier
+    marker shows a newer message from another worker, or when the entry has not
+    been synced for CHAT_HISTORY_SYNC_SECONDS.
+    """
+
+    def __init__(self, max_conversations: int, max_messages: int):
+        self._max_conv = max_conversations
+        self._max_msgs = max_messages
+        self._data: "OrderedDict[str, deque]" = OrderedDict()
+        self._last_rk: Dict[str, str] = {}
+        self._synced: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _marker_key(conversation_id: str) -> str:
+        return f"chat:last:{conversation_id}"
+
+    def _marker(self, conversation_id: str) -> str:
+        shared = cache.tier("shared")
+        if shared is None:
+            return ""
+        hit, value, _ = shared.get(self._marker_key(conversation_id))
+        return value if hit else ""
+
+    def get(self, conversation_id: str) -> List[Dict[str, str]]:
+        with self._lock:
+            cached = conversation_id in self._data
+            after = self._last_rk.get(conversation_id) if cached else None
+            fresh = cached and time.monotonic() - self._synced.get(conversation_id, 0) < CHAT_HISTORY_SYNC_SECONDS
+        # shared-tier and table reads happen outside the lock
+        if fresh and self._marker(conversation_id) <= (after or ""):
+            with self._lock:
+                msgs = self._data.get(conversation_id)
+                if msgs is not None:
+                    self._data.move_to_end(conversation_id)
+                    return list(msgs)
+            after = None  # evicted meanwhile: reload in full
+        try:
+            rows = list_messages(conversation_id, top=self._max_msgs, after=after)
+        except Exception as ex:
+            log.warning(f"history load failed for {conversation_id}: {ex}")
+            rows = []
+        with self._lock:
+            msgs = self._data.get(conversation_id)
+            if msgs is None:
+                msgs = self._data[conversation_id] = deque(maxlen=self._max_msgs)
+            last = self._last_rk.get(conversation_id, "")
+            for r in rows:
+                if r["row_key"] > last and r.get("role") in ("user", "assistant"):
+                    msgs.append({"role": r["role"], "content": r["text"]})
+                    last = r["row_key"]
+            if last:
+                self._last_rk[conversation_id] = last
+            self._synced[conversation_id] = time.monotonic()
+            self._data.move_to_end(conversation_id)
+            self._evict()
+            return list(msgs)
+
+    def append(self, conversation_id: str, role: str, content: str, row_key: str) -> None:
+        with self._lock:
+            msgs = self._data.setdefault(conversation_id, deque(maxlen=self._max_msgs))
+            msgs.append({"role": role, "content": content})
+            self._last_rk[conversation_id] = max(row_key, self._last_rk.get(conversation_id, ""))
+            self._data.move_to_end(conversation_id)
+            self._evict()
+        shared = cache.tier("shared")
+        if shared is not None:  # tells the other workers on this host to re-read the tail
+            shared.set(self._marker_key(conversation_id), row_key, time.time() + 86400)
+
+    def _evict(self) -> None:
+        while len(self._data) > self._max_conv:
+            cid, _ = self._data.popitem(last=False)
+            self._last_rk.pop(cid, None)
+            self._synced.pop(cid, None)
+
+
+_history = _History(CHAT_HISTORY_CONVERSATIONS, CHAT_HISTORY_MESSAGES)
+# a single writer keeps each worker's turns in submission order
+_persist_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-persist")
+_rk_lock = threading.Lock()
+_rk_last = dt.datetime.min
+
+
+def _next_row_key() -> str:
+    """Strictly increasing message RowKey for this worker (same format as save_message's)."""
+    global _rk_last
+    with _rk_lock:
+        now = dt.datetime.utcnow()
+        if now <= _rk_last:
+            now = _rk_last + dt.timedelta(microseconds=1)
+        _rk_last = now
+        return now.strftime(MESSAGE_RK_FORMAT)
+
+
+def _persist(conversation_id: str, role: str, text: str, row_key: str) -> None:
+    try:
+        save_message(conversation_id, role, text, row_key=row_key)
+    except Exception as ex:
+        log.warning(f"save_message failed for {conversation_id}: {ex}")
+
+
+def remember(conversation_id: str, role: str, text: str) -> None:
+    """Add a turn to the cache now and to the Messages table in the background."""
+    row_key = _next_row_key()
+    _history.append(conversation_id, role, text, row_key)
+    _persist_pool.submit(_persist, conversation_id, role, text, row_key)
+
+
+def stream_reply(conversation_id: str, user_msg: str) -> Iterator[str]:
+    """Yield completion deltas as they arrive; the turn is recorded once the stream ends
+    (also when the client disconnects mid-stream, with whatever was produced)."""
+    messages = [{"role": "system", "content": SYSTEM_PROMPT},
+                *_history.get(conversation_id),
+                {"role": "user", "content": user_msg}]
+    remember(conversation_id, "user", user_msg)
+    parts: List[str] = []
+    try:
+        # held for the whole stream, so chat has its own pool rather than upstream_slot's:
+        # long replies must not leave the alert path waiting for a slot
+        with admission.chat_slot():
+            stream = _aoai_client().chat.completions.create(
+                model=AOAI_DEPLOYMENT,
+                messages=messages,
+                temperature=0.2,
+                max_tokens=CHAT_MAX_TOKENS,
+                stream=True,
+            )
+            for chunk in stream:
+                if not chunk.choices:  # Azure sends a prompt-filter chunk with no choices first
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+    finally:
+        if parts:
+            remember(conversation_id, "assistant", "".join(parts))
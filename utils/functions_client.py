@@ -1,20 +1,25 @@
 # saude-app/utils/functions_client.py
 import os, httpx
 from .auth import functions_auth_headers
+from .tracing import span, propagation_headers, KIND_CLIENT
 
 AGENT_SRE_FUNC_URL  = os.getenv("AGENT_SRE_FUNC_URL")
 AGENT_INFO_FUNC_URL = os.getenv("AGENT_INFO_FUNC_URL")
 
 def start_sre_triage(payload: dict) -> dict:
     """Call SRE Durable Function start endpoint with auth headers."""
-    with httpx.Client(timeout=60) as c:
-        r = c.post(AGENT_SRE_FUNC_URL, json=payload, headers=functions_auth_headers("sre"))
+    with span("functions.sre.start_triage", kind=KIND_CLIENT) as sp, httpx.Client(timeout=60) as c:
+        r = c.post(AGENT_SRE_FUNC_URL, json=payload, headers={**functions_auth_headers("sre"), **propagation_headers()})
+        if sp:
+            sp.set("http.status_code", r.status_code)
         r.raise_for_status()
         return r.json()
 
 def agent_info_request(payload: dict) -> dict:
     """Call Agent-Info HTTP function with auth headers."""
-    with httpx.Client(timeout=60) as c:
-        r = c.post(AGENT_INFO_FUNC_URL, json=payload, headers=functions_auth_headers("info"))
+    with span("functions.info.request", kind=KIND_CLIENT) as sp, httpx.Client(timeout=60) as c:
+        r = c.post(AGENT_INFO_FUNC_URL, json=payload, headers={**functions_auth_headers("info"), **propagation_headers()})
+        if sp:
+            sp.set("http.status_code", r.status_code)
         r.raise_for_status()
         return r.json()
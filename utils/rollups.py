@@ -0,0 +1,247 @@
+# saude-app/utils/rollups.py
+"""Running counters over AgentDecisions, bucketed by hour/day.
+
+Layout of the rollup table (one entity per bucket/value/writer):
+    PartitionKey = "<grain>|<dim>"                  e.g. "hour|category"
+                   "<grain>|pipeline_category|<p>"  per-pipeline category counts
+    RowKey       = "<bucket>|<value>|<writer>"      e.g. "2026101914|Transient|web0-4711"
+    count        = int
+
+Each worker counts in memory and a background thread flushes the deltas into
+its own partial-counter rows (writer = host-pid), so `save_decision` does no
+extra round trips and workers never contend on the same entity. Reads sum the
+partials: a time window is one RowKey range query on one partition, so stats
+cost the same however large AgentDecisions grows.
+
+Rebuild from history:  python -m utils.rollups rebuild
+Only buckets before today (UTC) are rebuilt; today's buckets are still being
+written by live workers, so replacing them would race with their flushes.
+"""
+from __future__ import annotations
+import os
+import re
+import sys
+import time
+import atexit
+import socket
+import threading
+import datetime as dt
+import logging
+from collections import defaultdict
+from typing import Optional, Dict, Any, List, Iterable, Tuple
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+
+from .storage import get_table, TABLE_DECISIONS
+from .startup import import_timed
+
+UpdateMode = import_timed("azure.data.tables").UpdateMode
+
+log = logging.getLogger("utils.rollups")
+
+TABLE_ROLLUPS = os.getenv("TABLE_ROLLUPS", "DecisionRollups")
+ROLLUP_FLUSH_SECONDS = float(os.getenv("ROLLUP_FLUSH_SECONDS", "5"))
+MAX_RETRIES = 8
+
+GRAINS = {"hour": "%Y%m%d%H", "day": "%Y%m%d"}
+DIMS = ("category", "action", "pipeline", "pipeline_category")
+MAX_WINDOW = {"hour": 24 * 31, "day": 366}
+
+# characters Table Storage does not allow in keys (plus our '|' separator)
+_KEY_BAD = re.compile(r"[/\\#?|\x00-\x1f\x7f]")
+
+
+def _key(v: Optional[str]) -> str:
+    return _KEY_BAD.sub("_", str(v or "unknown"))[:200]
+
+
+REBUILD_WRITER = "rebuild"
+
+
+def _writer_id() -> str:
+    return _key(f"{socket.gethostname()}-{os.getpid()}")
+
+
+def _parse_ts(ts: Optional[str]) -> dt.datetime:
+    if not ts:
+        return dt.datetime.utcnow()
+    try:
+        return dt.datetime.fromisoformat(ts.rstrip("Z"))
+    except ValueError:
+        return dt.datetime.utcnow()
+
+
+def _partition(grain: str, dim: str, pipeline: Optional[str] = None) -> str:
+    if dim == "pipeline_category":
+        return f"{grain}|{dim}|{_key(pipeline)}"
+    return f"{grain}|{dim}"
+
+
+def _counter_keys(when: dt.datetime, category, action, pipeline) -> Iterable[Tuple[str, str]]:
+    """(PartitionKey, "<bucket>|<value>") for every counter one decision bumps."""
+    values = {"category": category, "action": action, "pipeline": pipeline, "pipeline_category": category}
+    for grain, fmt in GRAINS.items():
+        bucket = when.strftime(fmt)
+        for dim in DIMS:
+            yield _partition(grain, dim, pipeline), f"{bucket}|{_key(values[dim])}"
+
+
+def _increment(t, pk: str, rk: str, by: int = 1) -> None:
+    """ETag-guarded read-modify-write; retries if the row changed underneath us."""
+    for _ in range(MAX_RETRIES):
+        try:
+            e = t.get_entity(partition_key=pk, row_key=rk)
+        except ResourceNotFoundError:
+            try:
+                t.create_entity({"PartitionKey": pk, "RowKey": rk, "count": by})
+                return
+            except ResourceExistsError:
+                continue  # lost the create race; re-read and merge
+        e["count"] = int(e.get("count") or 0) + by
+        try:
+            t.update_entity(e, mode=UpdateMode.MERGE, etag=e.metadata["etag"],
+                            match_condition=MatchConditions.IfNotModified)
+            return
+        except ResourceModifiedError:
+            continue
+    raise RuntimeError(f"rollup increment gave up after {MAX_RETRIES} retries: {pk}/{rk}")
+
+
+# ---------- per-worker pending deltas ----------
+_pending: Dict[Tuple[str, str], int] = defaultdict(int)
+_pending_lock = threading.Lock()
+_flusher: Optional[threading.Thread] = None
+
+
+def flush() -> None:
+    """Write this worker's pending deltas into its own partial-counter rows."""
+    with _pending_lock:
+        batch = dict(_pending)
+        _pending.clear()
+    if not batch:
+        return
+    writer = _writer_id()
+    failed: Dict[Tuple[str, str], int] = {}
+    try:
+        t = get_table(TABLE_ROLLUPS)
+    except Exception as ex:
+        log.warning(f"rollup flush skipped: {ex}; will retry")
+        failed = batch
+    else:
+        for (pk, rk), n in batch.items():
+            try:
+                _increment(t, pk, f"{rk}|{writer}", n)
+            except Exception as ex:
+                log.warning(f"rollup flush failed for {pk}/{rk}: {ex}; will retry")
+                failed[(pk, rk)] = n
+    if failed:
+        with _pending_lock:
+            for key, n in failed.items():
+                _pending[key] += n
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(ROLLUP_FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception as ex:
+            log.warning(f"rollup flush loop error: {ex}")
+
+
+def _ensure_flusher() -> None:
+    global _flusher
+    if _flusher is None or not _flusher.is_alive():  # threads don't survive a fork
+        with _pending_lock:
+            if _flusher is None or not _flusher.is_alive():
+                _flusher = threading.Thread(target=_flush_loop, name="rollup-flush", daemon=True)
+                _flusher.start()
+
+
+atexit.register(flush)
+
+
+def record_decision(category: Optional[str], action: Optional[str], pipeline: Optional[str],
+                    created_at: Optional[str] = None) -> None:
+    """Count a decision in memory; the background flusher persists it within ROLLUP_FLUSH_SECONDS."""
+    with _pending_lock:
+        for key in _counter_keys(_parse_ts(created_at), category, action, pipeline):
+            _pending[key] += 1
+    _ensure_flusher()
+
+
+def query_stats(grain: str = "hour", dim: str = "category", window: int = 24,
+                pipeline: Optional[str] = None) -> Dict[str, Any]:
+    """Time series for the last `window` hours/days: {"buckets": [...], "series": {value: [counts]}}.
+
+    `pipeline` is required for dim="pipeline_category" (series per category of that
+    pipeline) and rejected for the other dims.
+    """
+    if grain not in GRAINS:
+        raise ValueError(f"grain must be one of {sorted(GRAINS)}")
+    if dim not in DIMS:
+        raise ValueError(f"dim must be one of {list(DIMS)}")
+    if not 1 <= window <= MAX_WINDOW[grain]:
+        raise ValueError(f"window must be between 1 and {MAX_WINDOW[grain]} for grain={grain}")
+    if dim == "pipeline_category" and not pipeline:
+        raise ValueError("dim=pipeline_category needs a pipeline")
+    if pipeline and dim != "pipeline_category":
+        raise ValueError("pipeline is only supported with dim=pipeline_category")
+    fmt = GRAINS[grain]
+    step = dt.timedelta(hours=1) if grain == "hour" else dt.timedelta(days=1)
+    now = dt.datetime.utcnow()
+    buckets = [(now - step * i).strftime(fmt) for i in reversed(range(window))]
+
+    t = get_table(TABLE_ROLLUPS)
+    flt = "PartitionKey eq @pk and RowKey ge @lo and RowKey lt @hi"
+    params = {"pk": _partition(grain, dim, pipeline), "lo": buckets[0], "hi": buckets[-1] + "|~"}
+    index = {b: i for i, b in enumerate(buckets)}
+    series: Dict[str, List[int]] = defaultdict(lambda: [0] * len(buckets))
+    for e in t.query_entities(flt, parameters=params, select=["RowKey", "count"]):
+        bucket, value = e["RowKey"].split("|")[:2]  # third part is the writer; partials are summed
+        if bucket in index:
+            series[value][index[bucket]] += int(e.get("count") or 0)
+    return {"grain": grain, "dim": dim, "pipeline": pipeline, "buckets": buckets, "series": dict(series)}
+
+
+def rebuild_rollups() -> int:
+    """Recompute counters for every bucket before today (UTC) from AgentDecisions.
+
+    Today's buckets are left alone: live workers keep flushing into them, and
+    replacing them here would drop or double-count those increments.
+    """
+    today = dt.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    cutoff = {grain: today.strftime(fmt) for grain, fmt in GRAINS.items()}
+
+    def before_cutoff(pk: str, bucket: str) -> bool:
+        return bucket < cutoff[pk.split("|")[0]]
+
+    counts: Dict[Tuple[str, str], int] = defaultdict(int)
+    n = 0
+    dec = get_table(TABLE_DECISIONS)
+    for e in dec.list_entities(select=["PartitionKey", "createdAt", "category", "action", "pipeline"]):
+        when = _parse_ts(e.get("createdAt"))
+        if when >= today:
+            continue
+        pipeline = e.get("pipeline") or e.get("PartitionKey")
+        for pk, rk in _counter_keys(when, e.get("category"), e.get("action"), pipeline):
+            counts[(pk, f"{rk}|{REBUILD_WRITER}")] += 1
+        n += 1
+
+    t = get_table(TABLE_ROLLUPS)
+    for e in t.list_entities(select=["PartitionKey", "RowKey"]):
+        pk, rk = e["PartitionKey"], e["RowKey"]
+        if before_cutoff(pk, rk.split("|")[0]) and (pk, rk) not in counts:
+            t.delete_entity(partition_key=pk, row_key=rk)
+    for (pk, rk), c in counts.items():
+        t.upsert_entity({"PartitionKey": pk, "RowKey": rk, "count": c}, mode=UpdateMode.REPLACE)
+    log.info(f"rebuilt {len(counts)} rollup counters from {n} decisions before {today.date()}")
+    return n
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python -m utils.rollups rebuild")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    print(f"rebuilt rollups from {rebuild_rollups()} decisions")
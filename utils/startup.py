@@ -0,0 +1,166 @@
+# saude-app/utils/startup.py
+"""Start-up timing and the optional warm-up phase.
+
+Heavy SDKs are imported on first use. With WARMUP_ON_START=true each worker
+pays that cost in a background thread right after boot instead: it imports
+the SDKs, acquires tokens, opens the storage connection pools and makes sure
+the tables exist. /healthz reports the warm-up state, and /api/startup
+returns the timing report (per-module import cost, warm-up steps, time to
+first request).
+"""
+import os
+import sys
+import time
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger("utils.startup")
+
+PROCESS_START = time.time()  # this module is the first thing app.py imports
+
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "false").lower() == "true"
+# while warming, /healthz answers 503 so App Service keeps traffic on warm instances
+WARMUP_GATES_HEALTH = os.getenv("WARMUP_GATES_HEALTH", "true").lower() == "true"
+
+HEAVY_MODULES = (
+    "azure.identity",
+    "azure.data.tables",
+    "azure.storage.blob",
+    "azure.mgmt.resourcegraph",
+    "openai",
+)
+
+_lock = threading.Lock()
+_report = {
+    "pid": os.getpid(),
+    "modules": {},          # module -> first-import ms
+    "preloaded": [],        # deferred modules already imported by something else when first asked for
+    "phases": {},           # app start-up phases -> ms
+    "warmup": {"state": "disabled" if not WARMUP_ON_START else "pending", "steps": {}},
+    "app_ready_ms": None,   # process start -> app object ready
+    "first_request_ms": None,
+}
+
+
+def _ms(t0: float) -> float:
+    return round((time.perf_counter() - t0) * 1000, 1)
+
+
+@contextmanager
+def timed(phase: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _report["phases"][phase] = _ms(t0)
+
+
+def import_timed(name: str):
+    """Import `name`, recording its cost the first time it is loaded in this worker.
+
+    Every deferred SDK import goes through here. A module that some other import
+    already pulled in is still listed, under "preloaded", so the report does
+    not depend on which code path happened to load it first.
+    """
+    if name in sys.modules:
+        if name not in _report["modules"] and name not in _report["preloaded"]:
+            with _lock:
+                if name not in _report["modules"] and name not in _report["preloaded"]:
+                    _report["preloaded"].append(name)
+        return sys.modules[name]
+    t0 = time.perf_counter()
+    mod = importlib.import_module(name)
+    with _lock:
+        _report["modules"].setdefault(name, _ms(t0))
+    return mod
+
+
+def mark_app_ready() -> None:
+    _report["app_ready_ms"] = round((time.time() - PROCESS_START) * 1000, 1)
+
+
+def mark_first_request() -> None:
+    if _report["first_request_ms"] is None:
+        with _lock:
+            if _report["first_request_ms"] is None:
+                _report["first_request_ms"] = round((time.time() - PROCESS_START) * 1000, 1)
+                log.info(f"[startup] first request after {_report['first_request_ms']} ms")
+
+
+def warmup_state() -> str:
+    return _report["warmup"]["state"]
+
+
+def is_ready() -> bool:
+    return warmup_state() in ("disabled", "ready", "degraded")
+
+
+def report() -> dict:
+    with _lock:
+        return {
+            **_report,
+            "modules": dict(_report["modules"]),
+            "preloaded": list(_report["preloaded"]),
+            "phases": dict(_report["phases"]),
+            "warmup": {**_report["warmup"], "steps": dict(_report["warmup"]["steps"])},
+        }
+
+
+# ---------- warm-up ----------
+def _step(name: str, fn) -> bool:
+    t0 = time.perf_counter()
+    try:
+        fn()
+        res = {"ok": True, "ms": _ms(t0)}
+    except Exception as ex:
+        res = {"ok": False, "ms": _ms(t0), "error": str(ex)[:300]}
+        log.warning(f"[warmup] {name} failed: {ex}")
+    with _lock:
+        _report["warmup"]["steps"][name] = res
+    return res["ok"]
+
+
+def _run_warmup() -> None:
+    from . import storage, auth
+
+    ok = True
+    for m in HEAVY_MODULES:
+        ok &= _step(f"import:{m}", lambda m=m: import_timed(m))
+
+    if storage.ACCOUNT_URL:
+        ok &= _step("token:storage", lambda: storage.credential().get_token(storage.STORAGE_SCOPE))
+        tables = [storage.TABLE_MESSAGES, storage.TABLE_DECISIONS, storage.TABLE_API_LOGS,
+                  os.getenv("TABLE_ROLLUPS", "DecisionRollups")]
+        for t in tables:
+            ok &= _step(f"table:{t}", lambda t=t: storage.get_table(t))
+        ok &= _step(f"container:{storage.CONTEXT_CONTAINER}",
+                    lambda: storage.get_container(storage.CONTEXT_CONTAINER))
+    if auth.USE_AAD and auth.FUNC_APP_APP_ID_URI:
+        ok &= _step("token:functions", lambda: auth.functions_auth_headers("sre"))
+    if os.getenv("AOAI_ENDPOINT") and not os.getenv("AOAI_API_KEY"):
+        from .cache import get_token
+        ok &= _step("token:aoai", lambda: get_token(auth.credential(), "https://cognitiveservices.azure.com/.default"))
+
+    with _lock:
+        _report["warmup"]["state"] = "ready" if ok else "degraded"
+        _report["warmup"]["total_ms"] = round(sum(s["ms"] for s in _report["warmup"]["steps"].values()), 1)
+    log.info(f"[warmup] {_report['warmup']['state']} in {_report['warmup']['total_ms']} ms")
+
+
+def start_warmup() -> None:
+    """Kick off warm-up in the background (no-op unless WARMUP_ON_START=true)."""
+    if not WARMUP_ON_START or _report["warmup"]["state"] != "pending":
+        return
+    _report["warmup"]["state"] = "warming"
+
+    def run():
+        try:
+            _run_warmup()
+        except Exception as ex:  # never leave /healthz stuck on "warming"
+            log.warning(f"[warmup] aborted: {ex}")
+            _report["warmup"]["state"] = "degraded"
+
+    threading.Thread(target=run, name="warmup", daemon=True).start()
@@ -3,11 +3,18 @@ import os
 import uuid
 import datetime as dt
 import json ,uuid
+import gzip
+import hashlib
 import logging
-from typing import Optional, Dict, Any, List  # <-- this fixes "Optional not defined"
-from azure.identity import DefaultAzureCredential, ManagedIdentityCredential, ChainedTokenCredential
-from azure.identity import DefaultAzureCredential
-from azure.data.tables import TableServiceClient
+from typing import Optional, Dict, Any, List, TYPE_CHECKING  # <-- this fixes "Optional not defined"
+import threading
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from .tracing import span, KIND_CLIENT
+from .startup import import_timed
+
+if TYPE_CHECKING:  # the SDKs are imported on first use to keep worker start-up cheap
+    from azure.data.tables import TableServiceClient, TableClient
+    from azure.storage.blob import BlobServiceClient, ContainerClient
 
 # Set up logging
 #logging.basicConfig(level=logging.INFO)
@@ -23,18 +30,62 @@ TABLE_API_LOGS = os.getenv("TABLE_API_LOGS", "ApiLogs")
 
 MAX_STR = 32000  # stay well under Table Storage per-property limits
 
-
-_cred = ChainedTokenCredential(
-    ManagedIdentityCredential(),
-    DefaultAzureCredential(exclude_shared_token_cache_credential=True),
-)
-
-
-def _service() -> TableServiceClient:
+# Large decision contexts go to blob storage; the table row only keeps a pointer.
+# Blob endpoint defaults to the same account as the tables.
+BLOB_ACCOUNT_URL = (os.getenv("BLOB_ACCOUNT_URL") or ACCOUNT_URL.replace(".table.", ".blob.")).rstrip("/")
+CONTEXT_CONTAINER = os.getenv("CONTEXT_CONTAINER", "decision-contexts")
+CONTEXT_INLINE_MAX = int(os.getenv("CONTEXT_INLINE_MAX", "4096"))  # chars kept inline in the row
+CONTEXT_CODEC = os.getenv("CONTEXT_CODEC", "gzip").lower()  # gzip | zstd (needs `zstandard`)
+
+STORAGE_SCOPE = "https://storage.azure.com/.default"
+
+
+# Credential and service clients are created once per worker, on first use;
+# reusing the service clients keeps their HTTP connection pools warm.
+_cred = None
+_table_svc: Optional["TableServiceClient"] = None
+_blob_svc: Optional["BlobServiceClient"] = None
+_tables: Dict[str, "TableClient"] = {}
+_containers: Dict[str, "ContainerClient"] = {}
+_lock = threading.Lock()
+
+
+def credential():
+    global _cred
+    if _cred is None:
+        with _lock:
+            if _cred is None:
+                identity = import_timed("azure.identity")
+                _cred = identity.ChainedTokenCredential(
+                    identity.ManagedIdentityCredential(),
+                    identity.DefaultAzureCredential(exclude_shared_token_cache_credential=True),
+                )
+    return _cred
+
+
+def _service() -> "TableServiceClient":
+    global _table_svc
     if not ACCOUNT_URL:
         raise RuntimeError("STORAGE_ACCOUNT_URL is not set")
-    # IMPORTANT: in azure-data-tables 12.x use endpoint= not account_url=
-    return TableServiceClient(endpoint=ACCOUNT_URL, credential=_cred)
+    if _table_svc is None:
+        TableServiceClient = import_timed("azure.data.tables").TableServiceClient
+        with _lock:
+            if _table_svc is None:
+                # IMPORTANT: in azure-data-tables 12.x use endpoint= not account_url=
+                _table_svc = TableServiceClient(endpoint=ACCOUNT_URL, credential=credential())
+    return _table_svc
+
+
+def _blob_service() -> "BlobServiceClient":
+    global _blob_svc
+    if not BLOB_ACCOUNT_URL:
+        raise RuntimeError("BLOB_ACCOUNT_URL / STORAGE_ACCOUNT_URL is not set")
+    if _blob_svc is None:
+        BlobServiceClient = import_timed("azure.storage.blob").BlobServiceClient
+        with _lock:
+            if _blob_svc is None:
+                _blob_svc = BlobServiceClient(account_url=BLOB_ACCOUNT_URL, credential=credential())
+    return _blob_svc
 
 
 
@@ -49,12 +100,109 @@ def _now_iso() -> str:
 
 
 def get_table(name: str):
+    """Table client for `name`; the table is created (at most) once per worker."""
+    t = _tables.get(name)
+    if t is not None:
+        return t
     svc = _service()
     try:
         svc.create_table_if_not_exists(name)
-    except ResourceExistsError:
+    except ResourceExistsError as e:
             log.debug(f"create_table_if_not_exists({name}) ignored: {e}")
-    return svc.get_table_client(name)
+    t = _tables[name] = svc.get_table_client(name)
+    return t
+
+
+def get_container(name: str):
+    cc = _containers.get(name)
+    if cc is not None:
+        return cc
+    cc = _blob_service().get_container_client(name)
+    try:
+        cc.create_container()
+    except ResourceExistsError:
+        pass
+    _containers[name] = cc
+    return cc
+
+
+# ---------- decision context offload ----------
+def _compress(raw: bytes) -> tuple[bytes, str]:
+    if CONTEXT_CODEC == "zstd":
+        try:
+            import zstandard
+            return zstandard.ZstdCompressor(level=3).compress(raw), "zstd"
+        except ImportError:
+            log.warning("CONTEXT_CODEC=zstd but 'zstandard' is not installed; using gzip")
+    return gzip.compress(raw, compresslevel=6), "gzip"
+
+
+_MAGIC = {"gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd"}
+
+
+def _decompress(data: bytes, encoding: str) -> bytes:
+    # blobs written before the codec moved out of Content-Encoding come back already
+    # inflated by the SDK; pass those through instead of failing on them
+    if not data.startswith(_MAGIC.get(encoding, _MAGIC["gzip"])):
+        return data
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _offload_context(context_json: Optional[str], row_key: str) -> Dict[str, Any]:
+    """Return the context properties for a decision row.
+
+    Small contexts stay inline. Larger ones are compressed into CONTEXT_CONTAINER
+    under their SHA-256, so identical payloads are stored once; the row keeps
+    only the blob name, the raw size and the hash.
+    """
+    if not context_json or len(context_json) <= CONTEXT_INLINE_MAX:
+        return {"context": context_json}
+
+    raw = context_json.encode("utf-8")
+    sha = hashlib.sha256(raw).hexdigest()
+    try:
+        cc = get_container(CONTEXT_CONTAINER)
+        # content-addressed: the codec is part of the name so mixed deployments never clash.
+        # The codec lives only in the name and the row (contextEncoding), never in
+        # Content-Encoding: the SDK would otherwise inflate the body on download.
+        ContentSettings = import_timed("azure.storage.blob").ContentSettings
+        data, encoding = _compress(raw)
+        blob_name = f"{sha[:2]}/{sha}.json.{'zst' if encoding == 'zstd' else 'gz'}"
+        with span("blob.upload_context", kind=KIND_CLIENT, **{"blob.size": len(data)}) as sp:
+            try:
+                cc.upload_blob(
+                    blob_name,
+                    data,
+                    overwrite=False,
+                    metadata={"sha256": sha, "firstRowKey": row_key},
+                    content_settings=ContentSettings(content_type=f"application/{encoding}"),
+                )
+            except ResourceExistsError:
+                log.debug(f"context blob {blob_name} already stored; deduplicated")
+                if sp:
+                    sp.set("blob.deduplicated", True)
+        return {
+            "context": None,
+            "contextBlob": blob_name,
+            "contextEncoding": encoding,
+            "contextSize": len(raw),
+            "contextSha256": sha,
+        }
+    except Exception as ex:
+        log.warning(f"context offload failed for {row_key}: {ex}; storing truncated inline")
+        return {"context": context_json[:MAX_STR], "contextSize": len(raw), "contextSha256": sha}
+
+
+def load_context(entity: Dict[str, Any]) -> Optional[str]:
+    """Inline context if present, otherwise fetch and decompress the offloaded blob."""
+    if entity.get("context") or not entity.get("contextBlob"):
+        return entity.get("context")
+    cc = _blob_service().get_container_client(CONTEXT_CONTAINER)
+    data = cc.download_blob(entity["contextBlob"], max_concurrency=1).readall()
+    return _decompress(data, entity.get("contextEncoding") or "gzip").decode("utf-8")
 
 
 def save_decision(
@@ -70,30 +218,48 @@ def save_decision(
     context_json: Optional[str] = None,
     why: Optional[str] = None,
 ) -> None:
-    t = get_table(TABLE_DECISIONS)
-    entity = {
-        "PartitionKey": (pipeline_name or "unknown"),
-        "RowKey": f"{(run_id or conversation_id)}-{int(dt.datetime.utcnow().timestamp()*1000)}",
-        "createdAt": dt.datetime.utcnow().isoformat() + "Z",
-        "conversationId": conversation_id,
-        "agent": agent,
-        "category": category,
-        "action": action,
-        "attempt": attempt,
-        "pipeline": pipeline_name,
-        "run_id": run_id,
-        "status": status,
-        "instance_id": instance_id,
-        "context": context_json,
-        "why": why,
-    }
-    t.upsert_entity(entity)   
+    with span("storage.save_decision", **{"decision.action": action, "decision.category": category}):
+        t = get_table(TABLE_DECISIONS)
+        row_key = f"{(run_id or conversation_id)}-{int(dt.datetime.utcnow().timestamp()*1000)}"
+        entity = {
+            "PartitionKey": (pipeline_name or "unknown"),
+            "RowKey": row_key,
+            "createdAt": dt.datetime.utcnow().isoformat() + "Z",
+            "conversationId": conversation_id,
+            "agent": agent,
+            "category": category,
+            "action": action,
+            "attempt": attempt,
+            "pipeline": pipeline_name,
+            "run_id": run_id,
+            "status": status,
+            "instance_id": instance_id,
+            "why": why,
+            **_offload_context(context_json, row_key),
+        }
+        with span("tables.upsert", kind=KIND_CLIENT, **{"table": TABLE_DECISIONS}):
+            t.upsert_entity(entity)   
+        # keep dashboard counters current; a rollup hiccup must not lose the decision
+        try:
+            from .rollups import record_decision  # local import: rollups imports this module
+            with span("rollups.update"):
+                record_decision(category, action, pipeline_name, entity["createdAt"])
+        except Exception as ex:
+            log.warning(f"rollup update failed for {row_key}: {ex}")
     # normalize payload
 
 
+# Listing columns: never the context itself (see get_decision for that)
+DECISION_LIST_SELECT = [
+    "PartitionKey", "RowKey", "createdAt", "pipeline", "category", "action", "status",
+    "why", "run_id", "instance_id", "contextSize", "contextBlob",
+]
+
+
 def list_decisions(pipeline: Optional[str] = None, top: int = 50) -> List[Dict[str, Any]]:
     t = get_table(TABLE_DECISIONS)
-    it = t.query_entities(f"PartitionKey eq '{pipeline}'") if pipeline else t.list_entities()
+    it = (t.query_entities("PartitionKey eq @pk", parameters={"pk": pipeline}, select=DECISION_LIST_SELECT)
+          if pipeline else t.list_entities(select=DECISION_LIST_SELECT))
     rows = list(it)
     rows.sort(key=lambda e: e.get("createdAt", ""), reverse=True)
     return [{
@@ -105,19 +271,66 @@ def list_decisions(pipeline: Optional[str] = None, top: int = 50) -> List[Dict[s
         "why": e.get("why"),
         "run_id": e.get("run_id"),
         "instance_id": e.get("instance_id"),
-        "context": e.get("context") or "",
-        "payload": e.get("payload") or "",
+        "row_key": e.get("RowKey"),
+        "contextSize": e.get("contextSize"),
+        "contextOffloaded": bool(e.get("contextBlob")),
     } for e in rows[:top]]
 
 
+def get_decision(pipeline: str, row_key: str) -> Optional[Dict[str, Any]]:
+    """Single decision with its full context (lazily pulled from blob if offloaded)."""
+    t = get_table(TABLE_DECISIONS)
+    try:
+        e = t.get_entity(partition_key=pipeline, row_key=row_key)
+    except ResourceNotFoundError:
+        return None
+    out = {
+        "ts": e.get("createdAt"),
+        "pipeline_name": e.get("pipeline") or e.get("PartitionKey"),
+        "row_key": e.get("RowKey"),
+        "category": e.get("category"),
+        "action": e.get("action"),
+        "status": e.get("status"),
+        "why": e.get("why"),
+        "run_id": e.get("run_id"),
+        "instance_id": e.get("instance_id"),
+        "contextSize": e.get("contextSize"),
+        "contextSha256": e.get("contextSha256"),
+        "context": "",
+    }
+    try:
+        out["context"] = load_context(e) or ""
+    except Exception as ex:
+        log.warning(f"context load failed for {pipeline}/{row_key}: {ex}")
+        out["contextError"] = f"context blob unavailable: {type(ex).__name__}"
+    return out
+
+
+
+
+MESSAGE_RK_FORMAT = "%Y%m%dT%H%M%S%fZ"
+
+
+def save_message(conversation_id: str, role: str, text: str, row_key: Optional[str] = None):
+    t = get_table(TABLE_MESSAGES)
+    pk = conversation_id or "default"
+    rk = row_key or dt.datetime.utcnow().strftime(MESSAGE_RK_FORMAT)
+    t.upsert_entity({"PartitionKey": pk, "RowKey": rk, "role": role, "text": (text or "")[:MAX_STR]})
+    log.info(f"Saved message to table '{TABLE_MESSAGES}' for conversation '{pk}'.")
 
 
-def save_message(conversation_id: str, role: str, text: str):
-    t = _table(TABLE_MESSAGES)
+def list_messages(conversation_id: str, top: int = 40, after: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Last `top` messages of a conversation, oldest first (RowKey is a sortable timestamp).
+    With `after`, only messages whose RowKey sorts after it (a cheap range read of the tail)."""
+    t = get_table(TABLE_MESSAGES)
     pk = conversation_id or "default"
-    rk = dt.datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
-    t.upsert_entity({"PartitionKey": pk, "RowKey": rk, "role": role, "text": text})
-    logger.info(f"Saved message to table '{TABLE_MESSAGES}' for conversation '{pk}'.")
+    if after:
+        it = t.query_entities("PartitionKey eq @pk and RowKey gt @rk", parameters={"pk": pk, "rk": after},
+                              select=["RowKey", "role", "text"])
+    else:
+        it = t.query_entities("PartitionKey eq @pk", parameters={"pk": pk}, select=["RowKey", "role", "text"])
+    rows = sorted(it, key=lambda e: e["RowKey"])
+    return [{"row_key": e["RowKey"], "role": e.get("role"), "text": e.get("text") or ""} for e in rows[-top:]]
 
 
 def save_api_log(endpoint: str, method: str, status_code: int, duration_ms: Optional[int]):
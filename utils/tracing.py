@@ -0,0 +1,282 @@
+# saude-app/utils/tracing.py
+"""Lightweight request tracing with OpenTelemetry-compatible JSON output.
+
+A traced route (see `traced`) opens a root span; code underneath adds timed
+child spans with `span(...)`. When the request ends the whole trace is written
+as one OTLP/JSON `resourceSpans` document per line to TRACE_EXPORT_PATH (or
+stdout), which an OTel collector `filelog`/`otlpjsonfile` receiver can ingest.
+Outside a traced request `span` is a no-op.
+
+The trace id doubles as correlation id: it is returned in `X-Trace-Id` and sent
+to the Functions as a W3C `traceparent` header.
+
+Export is off by default. TRACE_EXPORT=stdout sends traces to the App Service
+log stream; TRACE_EXPORT=file appends to TRACE_EXPORT_PATH, rotated at
+TRACE_EXPORT_MAX_BYTES with TRACE_EXPORT_BACKUPS old files kept.
+
+Profiling: set PROFILE_SAMPLE_RATE, or set PROFILE_TOKEN and send
+`X-Saude-Profile: <token>`, to capture a cProfile of the request into
+PROFILE_DIR/<trace_id>.prof (newest PROFILE_MAX_FILES kept); open it with
+snakeviz / flameprof / `python -m pstats`.
+"""
+import os
+import re
+import hmac
+import glob
+import json
+import time
+import random
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+log = logging.getLogger("utils.tracing")
+
+SERVICE_NAME        = os.getenv("OTEL_SERVICE_NAME", "saude-app")
+TRACE_EXPORT        = os.getenv("TRACE_EXPORT", "off").lower()  # off | stdout | file
+TRACE_EXPORT_PATH   = os.getenv("TRACE_EXPORT_PATH", os.path.join(tempfile.gettempdir(), "saude-traces.jsonl"))
+TRACE_EXPORT_MAX_BYTES = int(os.getenv("TRACE_EXPORT_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_EXPORT_BACKUPS   = int(os.getenv("TRACE_EXPORT_BACKUPS", "3"))
+PROFILE_HEADER      = "X-Saude-Profile"
+PROFILE_TOKEN       = os.getenv("PROFILE_TOKEN")  # header-triggered profiling is off unless set
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR         = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "saude-profiles"))
+PROFILE_MAX_FILES   = int(os.getenv("PROFILE_MAX_FILES", "20"))
+
+_TRACE_ID_RE = re.compile(r"[0-9a-f]{32}")
+_SPAN_ID_RE  = re.compile(r"[0-9a-f]{16}")
+
+# OTLP span kinds
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes)
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict[str, Any]:
+        out = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [_attr(k, v) for k, v in self.attributes.items() if v is not None],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            out["parentSpanId"] = self.parent_id
+        return out
+
+
+class Trace:
+    def __init__(self, trace_id: Optional[str] = None, parent_id: Optional[str] = None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.remote_parent = parent_id
+        self.spans: List[Span] = []
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("saude_trace", default=None)
+_span: ContextVar[Optional[Span]] = ContextVar("saude_span", default=None)
+_export_lock = threading.Lock()
+_profile_lock = threading.Lock()  # cProfile can only profile one request per process at a time
+
+
+def _attr(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        v = {"boolValue": value}
+    elif isinstance(value, int):
+        v = {"intValue": str(value)}
+    elif isinstance(value, float):
+        v = {"doubleValue": value}
+    else:
+        v = {"stringValue": str(value)}
+    return {"key": key, "value": v}
+
+
+def _parse_traceparent(header: Optional[str]):
+    """W3C traceparent: 00-<32 hex trace id>-<16 hex parent id>-<flags>.
+    Anything malformed yields (None, None) and the request gets a fresh trace id."""
+    parts = (header or "").strip().lower().split("-")
+    if len(parts) != 4:
+        return None, None
+    trace_id, parent_id = parts[1], parts[2]
+    if (_TRACE_ID_RE.fullmatch(trace_id) and _SPAN_ID_RE.fullmatch(parent_id)
+            and trace_id != "0" * 32 and parent_id != "0" * 16):
+        return trace_id, parent_id
+    return None, None
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    """Timed child span of the current one; yields None when no trace is active."""
+    trace, parent = _trace.get(), _span.get()
+    if trace is None:
+        yield None
+        return
+    s = Span(trace, name, parent.span_id if parent else trace.remote_parent, kind, attributes)
+    token = _span.set(s)
+    try:
+        yield s
+    except BaseException as ex:
+        s.error = f"{type(ex).__name__}: {ex}"[:500]
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _span.reset(token)
+        trace.spans.append(s)
+
+
+def set_attribute(key: str, value: Any) -> None:
+    s = _span.get()
+    if s is not None:
+        s.set(key, value)
+
+
+def current_trace_id() -> Optional[str]:
+    t = _trace.get()
+    return t.trace_id if t else None
+
+
+def traceparent() -> Optional[str]:
+    """traceparent header value pointing at the current span (for outgoing calls)."""
+    t, s = _trace.get(), _span.get()
+    if t is None:
+        return None
+    return f"00-{t.trace_id}-{s.span_id if s else os.urandom(8).hex()}-01"
+
+
+def propagation_headers() -> Dict[str, str]:
+    tp = traceparent()
+    return {"traceparent": tp, "x-correlation-id": current_trace_id()} if tp else {}
+
+
+def export(trace: Trace) -> None:
+    if TRACE_EXPORT == "off" or not trace.spans:
+        return
+    doc = {"resourceSpans": [{
+        "resource": {"attributes": [_attr("service.name", SERVICE_NAME), _attr("process.pid", os.getpid())]},
+        "scopeSpans": [{"scope": {"name": "saude.tracing"}, "spans": [s.to_otlp() for s in trace.spans]}],
+    }]}
+    line = json.dumps(doc, separators=(",", ":")) + "\n"
+    try:
+        if TRACE_EXPORT == "stdout":
+            print(line, end="", flush=True)
+        else:
+            with _export_lock:
+                _rotate_if_needed()
+                with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+                    f.write(line)
+    except OSError as ex:
+        log.warning(f"trace export failed: {ex}")
+
+
+def _rotate_if_needed() -> None:
+    """Size-based rotation: path -> path.1 -> ... -> path.N (oldest dropped)."""
+    try:
+        if os.path.getsize(TRACE_EXPORT_PATH) < TRACE_EXPORT_MAX_BYTES:
+            return
+    except FileNotFoundError:
+        return
+    for i in range(TRACE_EXPORT_BACKUPS - 1, 0, -1):
+        src = f"{TRACE_EXPORT_PATH}.{i}"
+        if os.path.exists(src):
+            os.replace(src, f"{TRACE_EXPORT_PATH}.{i + 1}")
+    if TRACE_EXPORT_BACKUPS > 0:
+        os.replace(TRACE_EXPORT_PATH, f"{TRACE_EXPORT_PATH}.1")
+    else:
+        os.remove(TRACE_EXPORT_PATH)
+
+
+def _want_profile(req) -> bool:
+    token = req.headers.get(PROFILE_HEADER)
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def traced(name: str):
+    """Flask view decorator: root span per request, export on exit, optional cProfile."""
+    def deco(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import request, after_this_request
+
+            trace_id, parent_id = _parse_traceparent(request.headers.get("traceparent"))
+            trace = Trace(trace_id, parent_id)
+            t_token = _trace.set(trace)
+            profiler = None
+            if _want_profile(request) and _profile_lock.acquire(blocking=False):
+                import cProfile
+                profiler = cProfile.Profile()
+
+            @after_this_request
+            def _add_headers(resp):
+                resp.headers["X-Trace-Id"] = trace.trace_id
+                return resp
+
+            try:
+                with span(name, kind=KIND_SERVER, **{"http.method": request.method,
+                                                     "http.route": request.url_rule.rule if request.url_rule else request.path}) as root:
+                    if profiler:
+                        profiler.enable()
+                    try:
+                        rv = view(*args, **kwargs)
+                    finally:
+                        if profiler:
+                            profiler.disable()
+                    status = rv[1] if isinstance(rv, tuple) and len(rv) > 1 and isinstance(rv[1], int) else getattr(rv, "status_code", 200)
+                    root.set("http.status_code", status)
+                    if profiler:
+                        root.set("profile.path", _dump_profile(profiler, trace.trace_id))
+                    return rv
+            finally:
+                if profiler:
+                    _profile_lock.release()
+                _trace.reset(t_token)
+                export(trace)
+        return wrapper
+    return deco
+
+
+def _dump_profile(profiler, trace_id: str) -> Optional[str]:
+    try:
+        if not _TRACE_ID_RE.fullmatch(trace_id):  # ids are generated/validated hex; never a path
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{trace_id}.prof")
+        profiler.dump_stats(path)
+        log.info(f"[profile] wrote {path}")
+        _prune_profiles()
+        return path
+    except OSError as ex:
+        log.warning(f"profile dump failed: {ex}")
+        return None
+
+
+def _prune_profiles() -> None:
+    """Keep only the newest PROFILE_MAX_FILES profiles."""
+    files = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.prof")), key=os.path.getmtime, reverse=True)
+    for old in files[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass